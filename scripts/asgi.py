@@ -0,0 +1,18 @@
+# scripts/asgi.py
+#
+# Version: 1.0.0
+# Date: 2026-10-15
+# Author: Rolland MELET & AI Senior Coder
+# Description: Point d'entrée ASGI de l'API Docling (alternative à gunicorn).
+#              L'application Flask de start_api.py est enveloppée par asgiref pour être servie par uvicorn,
+#              dont la boucle d'événements reçoit les corps d'upload pendant que d'autres requêtes sont traitées.
+#
+# Dépendances supplémentaires: pip install asgiref "uvicorn[standard]"
+# Lancement (depuis le dossier scripts/):
+#   uvicorn asgi:application --workers 4 --loop uvloop --http httptools --host 0.0.0.0 --port 5000
+
+from asgiref.wsgi import WsgiToAsgi
+
+from start_api import app
+
+application = WsgiToAsgi(app)
@@ -6,34 +6,183 @@
 # Description: Script pour envoyer un PDF à l'API Docling locale ou publique et afficher la sortie JSON.
 #              Mis à jour pour tester l'API Docling déployée sur Coolify.
 
+import argparse
+import asyncio
+import orjson
 import requests
-import json
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+import mmap
 import os
 import sys
+import uuid
+from concurrent.futures import ThreadPoolExecutor
 
 # --- Configuration de l'URL de l'API Docling publique ---
 # Pour tester en local, utilisez "http://localhost:5001"
 # Pour tester l'API déployée sur Coolify, utilisez l'URL de votre application
 DOCLING_API_BASE_URL = "https://enedis-automation-docling.rorworld.eu" # <--- L'URL PUBLIQUE ICI
 
+# --- Chemins (calculés une seule fois) ---
+SCRIPT_DIR = os.path.dirname(os.path.realpath(__file__))
+SAMPLE_PDF_DIR = os.path.realpath(os.path.join(SCRIPT_DIR, '..', 'tests', 'sample-pdfs'))
+
+# --- Session HTTP partagée ---
+# Une seule session pour /health et /extract : la connexion TCP+TLS est établie une fois
+# puis réutilisée depuis le pool, au lieu d'un nouveau handshake à chaque requête.
+# Les erreurs transitoires (502/503/504 du reverse proxy, connexion coupée) sont
+# retentées avec un backoff exponentiel (0.5s, 1s, 2s, ...) plutôt que d'arrêter le test.
+# /extract est idempotent côté serveur, le POST peut donc être renvoyé sans risque.
+RETRY_POLICY = Retry(
+    total=4,
+    backoff_factor=0.5,
+    status_forcelist=(502, 503, 504),
+    allowed_methods=frozenset(['GET', 'POST']),
+)
+# Délais (connexion, lecture) en secondes: un load balancer injoignable échoue en ~3s,
+# tandis que la lecture laisse au serveur le temps de traiter le PDF.
+HEALTH_TIMEOUT = (3.05, 10)
+EXTRACT_TIMEOUT = (3.05, 120)
+# Le pool accepte autant de connexions que de threads du mode batch.
+MAX_WORKERS = 8
+SESSION = requests.Session()
+SESSION.headers.update({'Connection': 'keep-alive'})
+SESSION.mount("https://", HTTPAdapter(max_retries=RETRY_POLICY, pool_connections=MAX_WORKERS, pool_maxsize=MAX_WORKERS))
+SESSION.mount("http://", HTTPAdapter(max_retries=RETRY_POLICY, pool_connections=MAX_WORKERS, pool_maxsize=MAX_WORKERS))
+
+# --- Corps multipart en streaming ---
+
+class StreamingMultipartFile:
+    """Corps multipart/form-data lu à la demande depuis le disque.
+
+    Contrairement à `requests.post(files=...)`, qui construit tout le corps en mémoire,
+    les octets du PDF sont lus par blocs au moment de l'envoi sur la socket. Le fichier est
+    mappé en mémoire (mmap): les blocs sont des memoryview sur les pages du cache disque,
+    transmises à la socket sans copie intermédiaire.
+    L'objet expose read/seek/tell : requests en déduit le Content-Length et urllib3
+    peut rembobiner le corps si la requête doit être renvoyée.
+    """
+
+    def __init__(self, field_name, file_path, content_type='application/pdf'):
+        boundary = uuid.uuid4().hex
+        filename = os.path.basename(file_path).replace('"', '%22')
+        self.content_type = f"multipart/form-data; boundary={boundary}"
+        self._head = (
+            f"--{boundary}\r\n"
+            f'Content-Disposition: form-data; name="{field_name}"; filename="{filename}"\r\n'
+            f"Content-Type: {content_type}\r\n\r\n"
+        ).encode('utf-8')
+        self._tail = f"\r\n--{boundary}--\r\n".encode('ascii')
+        self._file = open(file_path, 'rb')
+        self._file_size = os.fstat(self._file.fileno()).st_size
+        # mmap refuse les fichiers vides
+        self._mmap = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ) if self._file_size else None
+        self._view = memoryview(self._mmap) if self._mmap is not None else memoryview(b"")
+        self._length = len(self._head) + self._file_size + len(self._tail)
+        self._pos = 0
+
+    def _read_at(self, pos, size):
+        """Lit au plus `size` octets à la position `pos` dans l'un des trois segments."""
+        if pos < len(self._head):
+            return self._head[pos:pos + size]
+        pos -= len(self._head)
+        if pos < self._file_size:
+            return self._view[pos:pos + size]
+        pos -= self._file_size
+        return self._tail[pos:pos + size]
+
+    def read(self, size=-1):
+        if size is None or size < 0:
+            size = self._length - self._pos
+        chunks = []
+        while size > 0 and self._pos < self._length:
+            chunk = self._read_at(self._pos, size)
+            if not chunk:
+                break
+            self._pos += len(chunk)
+            size -= len(chunk)
+            chunks.append(chunk)
+        if len(chunks) == 1:
+            return chunks[0]  # Évite la copie de b"".join pour le cas courant d'un seul segment
+        return b"".join(chunks)
+
+    def __len__(self):
+        return self._length
+
+    def tell(self):
+        return self._pos
+
+    def seek(self, offset, whence=os.SEEK_SET):
+        if whence == os.SEEK_CUR:
+            offset += self._pos
+        elif whence == os.SEEK_END:
+            offset += self._length
+        self._pos = max(0, min(offset, self._length))
+        return self._pos
+
+    def close(self):
+        self._view.release()
+        if self._mmap is not None:
+            try:
+                self._mmap.close()
+            except BufferError:
+                pass  # Un bloc envoyé est encore référencé: le mapping sera libéré par le ramasse-miettes
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
 # --- Vérification des arguments de ligne de commande ---
-if len(sys.argv) < 2:
-    print("ERREUR: Veuillez spécifier le nom du fichier PDF à tester.")
-    print("Exemple: python3 scripts/extract-test.py 'Commande_4801387814.PDF'")
-    sys.exit(1) # Quitte le script si aucun argument n'est fourni
+# Échantillon utilisé quand aucun fichier n'est passé en argument
+DEFAULT_PDF_FILE_NAME = 'Commande_4801377867JPSM2025-03-19.PDF'
+
+parser = argparse.ArgumentParser(
+    description="Envoie un PDF (ou tous les PDF d'un dossier) à l'API Docling et affiche la sortie JSON.",
+    epilog="Exemples: python3 scripts/extract-test.py 'Commande_4801387814.PDF' | python3 scripts/extract-test.py . (tous les PDF de tests/sample-pdfs/)",
+)
+parser.add_argument(
+    "pdf", nargs="?", default=DEFAULT_PDF_FILE_NAME,
+    help=f"Fichier PDF, ou dossier de PDF pour le mode batch, relatif à tests/sample-pdfs/ (défaut: {DEFAULT_PDF_FILE_NAME}).",
+)
+parser.add_argument(
+    "--http2", action="store_true",
+    help="Mode batch: multiplexer les envois sur une seule connexion HTTP/2 avec httpx (pip install 'httpx[http2]').",
+)
+parser.add_argument(
+    "--skip-health", action="store_true",
+    help="Ne pas appeler /health: un backend indisponible est signalé par l'échec de /extract (après les retries).",
+)
+args = parser.parse_args()
 
-PDF_FILE_NAME = sys.argv[1] # Prend le premier argument comme nom de fichier
+PDF_FILE_NAME = args.pdf # Nom de fichier (ou dossier) passé en argument
 
-# Construit le chemin complet du fichier PDF à partir de l'emplacement du script
-file_path_for_test = os.path.join(os.path.dirname(__file__), '..', 'tests', 'sample-pdfs', PDF_FILE_NAME)
+# Fichier ou dossier: même règle, le chemin est relatif à tests/sample-pdfs/ (un chemin absolu est gardé tel quel)
+pdf_path_for_test = os.path.join(SAMPLE_PDF_DIR, PDF_FILE_NAME)
 
-# --- Vérification de l'existence du fichier PDF spécifié ---
-if not os.path.exists(file_path_for_test):
-    print(f"ERREUR: Le fichier PDF spécifié pour le test '{file_path_for_test}' n'existe pas.")
-    print(f"Veuillez vérifier que le fichier '{PDF_FILE_NAME}' est bien placé dans le dossier 'enedis-automation-docling/tests/sample-pdfs/'.")
-    sys.exit(1) # Quitte le script si le fichier n'est pas trouvé
+if os.path.isdir(pdf_path_for_test):
+    # --- Mode batch: tous les PDF du dossier sont envoyés en parallèle ---
+    pdf_paths_for_test = sorted(
+        os.path.join(pdf_path_for_test, name) for name in os.listdir(pdf_path_for_test)
+        if name.lower().endswith('.pdf')
+    )
+    if not pdf_paths_for_test:
+        print(f"ERREUR: Aucun fichier PDF trouvé dans le dossier '{pdf_path_for_test}'.")
+        sys.exit(1)
+    print(f"Mode batch: {len(pdf_paths_for_test)} fichier(s) PDF trouvé(s) dans '{pdf_path_for_test}'.")
 else:
-    print(f"Utilisation du fichier PDF ENEDIS: '{os.path.basename(file_path_for_test)}' pour le test.")
+    BASENAME = os.path.basename(pdf_path_for_test)
+
+    # --- Vérification de l'existence du fichier PDF spécifié ---
+    if not os.path.exists(pdf_path_for_test):
+        print(f"ERREUR: Le fichier PDF spécifié pour le test '{pdf_path_for_test}' n'existe pas.")
+        print(f"Veuillez vérifier que le fichier '{PDF_FILE_NAME}' est bien placé dans le dossier 'enedis-automation-docling/tests/sample-pdfs/'.")
+        sys.exit(1) # Quitte le script si le fichier n'est pas trouvé
+    else:
+        print(f"Utilisation du fichier PDF ENEDIS: '{BASENAME}' pour le test.")
+    pdf_paths_for_test = [pdf_path_for_test]
 
 # --- Fonctions de test de l'API ---
 
@@ -42,32 +191,51 @@ def test_health_check():
     health_url = f"{DOCLING_API_BASE_URL}/health"
     print(f"\nTentative de connexion à l'endpoint /health: {health_url}")
     try:
-        response = requests.get(health_url)
+        response = SESSION.get(health_url, timeout=HEALTH_TIMEOUT)
         response.raise_for_status()  # Lève une exception pour les codes d'état HTTP d'erreur (4xx ou 5xx)
         print("Réponse de l'endpoint /health:")
-        print(json.dumps(response.json(), indent=2))
+        print(orjson.dumps(orjson.loads(response.content), option=orjson.OPT_INDENT_2).decode())
         return True
     except requests.exceptions.RequestException as e:
         print(f"Erreur lors de la vérification de santé: {e}")
         print(f"Veuillez vérifier que l'API Docling est bien démarrée et accessible à {health_url}.")
         return False
 
-def test_extract_api():
+# Résultat du health check, mis en cache: /health n'est appelé qu'une fois par exécution.
+_HEALTH_OK = None
+
+def ensure_healthy():
+    """Appelle test_health_check() au premier appel seulement et retourne le résultat mis en cache."""
+    global _HEALTH_OK
+    if _HEALTH_OK is None:
+        _HEALTH_OK = test_health_check()
+    return _HEALTH_OK
+
+def post_pdf(file_path):
+    """Envoie un PDF à l'endpoint /extract et retourne la réponse JSON décodée."""
+    with StreamingMultipartFile('file', file_path) as body:
+        # Content-Length explicite: pas de Transfer-Encoding chunked, que certains reverse proxies
+        # mettent en tampon sur disque avant de le transmettre.
+        headers = {'Content-Type': body.content_type, 'Content-Length': str(len(body))}
+        response = SESSION.post(f"{DOCLING_API_BASE_URL}/extract", data=body, headers=headers, timeout=EXTRACT_TIMEOUT)
+        response.raise_for_status()
+        # response.content est déjà décompressé (gzip/deflate/br annoncés par défaut par requests):
+        # orjson le décode en une passe, sans la détection d'encodage de response.json().
+        return orjson.loads(response.content)
+
+def test_extract_api(file_path):
     """Teste l'endpoint /extract de l'API Docling en envoyant un fichier."""
     extract_url = f"{DOCLING_API_BASE_URL}/extract"
     print(f"\nTentative d'envoi du fichier à l'endpoint /extract: {extract_url}")
     
     try:
-        with open(file_path_for_test, 'rb') as f:
-            files = {'file': (os.path.basename(file_path_for_test), f, 'application/pdf')}
-            print(f"Envoi du fichier '{os.path.basename(file_path_for_test)}'...")
-            response = requests.post(extract_url, files=files, timeout=60)
-            response.raise_for_status()
+        print(f"Envoi du fichier '{os.path.basename(file_path)}'...")
+        extracted = post_pdf(file_path)
 
-            print("Réponse de l'endpoint /extract:")
-            print(json.dumps(response.json(), indent=2))
+        print("Réponse de l'endpoint /extract:")
+        print(orjson.dumps(extracted, option=orjson.OPT_INDENT_2).decode())
     except requests.exceptions.Timeout:
-        print(f"Erreur: Le délai d'attente pour la requête à {extract_url} a été dépassé (60 secondes).")
+        print(f"Erreur: Le délai d'attente pour la requête à {extract_url} a été dépassé ({EXTRACT_TIMEOUT[1]} secondes).")
         print("Le traitement du PDF pourrait être long ou l'API ne répond pas à temps.")
     except requests.exceptions.ConnectionError as e:
         print(f"Erreur de connexion à l'API: {e}.")
@@ -78,9 +246,56 @@ def test_extract_api():
             print("Contenu de la réponse d'erreur (si disponible):", e.response.text)
         print(f"Veuillez vérifier que l'API Docling est bien démarrée et que l'endpoint /extract est fonctionnel à {extract_url}.")
 
+def test_extract_batch(file_paths):
+    """Envoie plusieurs PDF en parallèle à /extract et affiche toutes les réponses en une fois."""
+    print(f"\nEnvoi de {len(file_paths)} fichier(s) à l'endpoint /extract ({MAX_WORKERS} requêtes en parallèle max)...")
+    with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
+        futures = [(path, executor.submit(post_pdf, path)) for path in file_paths]
+        results = []
+        for path, future in futures:
+            try:
+                results.append(future.result())
+            except requests.exceptions.RequestException as e:
+                results.append({"extracted_from": os.path.basename(path), "error": str(e)})
+    print("Réponses de l'endpoint /extract:")
+    print(orjson.dumps(results, option=orjson.OPT_INDENT_2).decode())
+
+async def _post_pdfs_http2(file_paths):
+    """Envoie les PDF en parallèle sous forme de flux HTTP/2 multiplexés sur une seule connexion."""
+    import httpx  # Dépendance optionnelle, uniquement pour --http2
+
+    extract_url = f"{DOCLING_API_BASE_URL}/extract"
+    limits = httpx.Limits(max_connections=1, max_keepalive_connections=1)
+    timeout = httpx.Timeout(EXTRACT_TIMEOUT[1], connect=EXTRACT_TIMEOUT[0])
+    async with httpx.AsyncClient(http2=True, limits=limits, timeout=timeout) as client:
+        async def post_one(file_path):
+            with open(file_path, 'rb') as f:
+                response = await client.post(extract_url, files={'file': (os.path.basename(file_path), f, 'application/pdf')})
+            response.raise_for_status()
+            return orjson.loads(response.content)
+
+        return await asyncio.gather(*(post_one(path) for path in file_paths), return_exceptions=True)
+
+def test_extract_batch_http2(file_paths):
+    """Variante de test_extract_batch utilisant httpx + HTTP/2 au lieu du pool de threads."""
+    print(f"\nEnvoi de {len(file_paths)} fichier(s) à l'endpoint /extract sur une connexion HTTP/2...")
+    responses = asyncio.run(_post_pdfs_http2(file_paths))
+    results = [
+        {"extracted_from": os.path.basename(path), "error": str(response)} if isinstance(response, Exception) else response
+        for path, response in zip(file_paths, responses)
+    ]
+    print("Réponses de l'endpoint /extract:")
+    print(orjson.dumps(results, option=orjson.OPT_INDENT_2).decode())
+
 # --- Exécution principale ---
 if __name__ == "__main__":
-    if test_health_check():
-        test_extract_api()
-    else:
-        print("\nLe health check a échoué. Arrêt du test d'extraction.")
\ No newline at end of file
+    with SESSION:
+        # Le health check n'est fait qu'une seule fois, même en mode batch.
+        if not args.skip_health and not ensure_healthy():
+            print("\nLe health check a échoué. Arrêt du test d'extraction.")
+        elif len(pdf_paths_for_test) == 1:
+            test_extract_api(pdf_paths_for_test[0])
+        elif args.http2:
+            test_extract_batch_http2(pdf_paths_for_test)
+        else:
+            test_extract_batch(pdf_paths_for_test)
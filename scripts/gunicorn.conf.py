@@ -0,0 +1,40 @@
+# scripts/gunicorn.conf.py
+#
+# Version: 1.0.0
+# Date: 2026-10-15
+# Author: Rolland MELET & AI Senior Coder
+# Description: Configuration gunicorn de l'API Docling (utilisée par le Dockerfile).
+#
+# Lancement (depuis n'importe quel dossier):
+#   gunicorn -c scripts/gunicorn.conf.py
+# Les options de la ligne de commande restent prioritaires (ex. `-w 2`).
+
+import os
+
+# L'application est importée depuis scripts/ (wsgi.py, start_api.py et ../config/)
+chdir = os.path.dirname(os.path.abspath(__file__))
+wsgi_app = "wsgi:app"
+
+bind = os.environ.get("GUNICORN_BIND", "0.0.0.0:5000")
+
+# Le parsing PDF est du Python pur (GIL): un processus par CPU apporte le parallélisme,
+# les threads servent surtout à absorber les uploads lents.
+# Avec PAVÉS en parallèle (PDF_PAGE_WORKERS > 1), réduire WEB_CONCURRENCY pour ne pas surcharger les CPU.
+workers = int(os.environ.get("WEB_CONCURRENCY", os.cpu_count() or 1))
+worker_class = "gthread"
+threads = 4
+
+# L'application (modules, règles compilées) est chargée une fois dans le maître puis partagée par fork
+# (copie à l'écriture): démarrage et recyclage des workers plus rapides, mémoire commune.
+# Une mise à jour du code demande alors un redémarrage complet (un HUP ne recharge pas l'application).
+preload_app = True
+
+# Laisse le temps aux longues commandes PDF d'être analysées (30 s par défaut)
+timeout = 120
+
+# Recycle périodiquement les workers pour borner la croissance mémoire
+max_requests = 500
+max_requests_jitter = 50
+
+# Battement de cœur des workers en mémoire plutôt que sur le disque du conteneur
+worker_tmp_dir = "/dev/shm" if os.path.isdir("/dev/shm") else None
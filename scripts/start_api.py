@@ -6,123 +6,354 @@
 # Description: API Flask pour le moteur d'extraction de commandes ENEDIS.
 #              Version avec nettoyage amélioré des blocs d'articles et extraction des champs généraux complets.
 
-from flask import Flask, request, jsonify
+from flask import Flask, Request, Response, request
 import os
-import json
 import io
+import orjson
 import re
+import hashlib
+import logging
+import functools
+import multiprocessing
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from dataclasses import dataclass
+from tempfile import SpooledTemporaryFile
 from pdfminer.high_level import extract_pages
-from pdfminer.layout import LTTextContainer, LTChar, LTFigure
-from PIL import Image
-import pytesseract
+from pdfminer.layout import LTTextContainer
+# PIL et pytesseract (OCR des PDF scannés) ne sont pas importés tant qu'aucune étape d'OCR ne les utilise.
+
+# PAVÉS (au-dessus de PLAYA-PDF) est optionnel: API compatible pdfminer.six, capable de répartir
+# l'analyse des pages sur plusieurs processus. Sans lui, l'extraction reste sur pdfminer.six.
+try:
+    import playa
+    from paves.miner import extract_page as paves_extract_page, LAParams as PavesLAParams, LTTextContainer as PavesLTTextContainer
+except ImportError:
+    playa = None
+
+# PyMuPDF est optionnel et n'est utilisé que si PDF_BACKEND=pymupdf (voir plus bas).
+try:
+    import pymupdf
+except ImportError:
+    pymupdf = None
+
+# Journalisation: niveau INFO par défaut (variable LOG_LEVEL), les traces détaillées du pipeline sont au niveau DEBUG.
+# getLevelName renvoie le numéro d'un niveau connu, et une chaîne ("Level VERBOSE") pour un nom inconnu:
+# une valeur invalide retombe alors sur INFO au lieu de faire échouer le démarrage.
+LOG_LEVEL = os.environ.get("LOG_LEVEL", "INFO").upper()
+_log_level = logging.getLevelName(LOG_LEVEL)
+logging.basicConfig(level=_log_level if isinstance(_log_level, int) else logging.INFO,
+                    format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+logger = logging.getLogger(__name__)
+if not isinstance(_log_level, int):
+    logger.warning("LOG_LEVEL=%s inconnu (DEBUG, INFO, WARNING, ERROR ou CRITICAL attendu): niveau INFO utilisé.", LOG_LEVEL)
+
+# Taille maximale acceptée pour un PDF uploadé (Flask répond 413 au-delà).
+MAX_UPLOAD_SIZE = 50 * 1024 * 1024
+# Signature en tête de tout fichier PDF
+PDF_MAGIC = b"%PDF-"
+
+class ExtractRequest(Request):
+    """Requête Flask qui garde les fichiers uploadés en mémoire jusqu'à MAX_UPLOAD_SIZE.
+
+    Par défaut Werkzeug bascule sur un fichier temporaire au-delà de 500 Ko, ce qui impose
+    une écriture puis une relecture disque pour chaque commande PDF de taille moyenne.
+    """
+
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        return SpooledTemporaryFile(max_size=MAX_UPLOAD_SIZE, mode='rb+')
 
 app = Flask(__name__)
+app.request_class = ExtractRequest
+app.config['MAX_CONTENT_LENGTH'] = MAX_UPLOAD_SIZE
 
 # Chemin vers le fichier de règles d'extraction
 RULES_FILE_PATH = os.path.join(os.path.dirname(__file__), '..', 'config', 'extraction-rules.json')
 
-# Chargement des règles d'extraction au démarrage de l'application
-extraction_rules = {}
-if os.path.exists(RULES_FILE_PATH):
+@dataclass(frozen=True)
+class GeneralFieldRule:
+    """Règle d'un champ général, avec ses patterns pré-compilés (re.IGNORECASE | re.DOTALL pour que . match les newlines)."""
+    field_name: str
+    patterns: tuple
+    is_float: bool
+    is_multiline: bool
+
+def build_general_field_rules(rules):
+    """Convertit rules["general_fields"] en tuple de GeneralFieldRule."""
+    return tuple(
+        GeneralFieldRule(
+            field_name=rule["field_name"],
+            patterns=tuple(re.compile(p, re.IGNORECASE | re.DOTALL) for p in rule["patterns"]),
+            is_float=rule.get("type") == "float",
+            is_multiline=bool(rule.get("multiline")),
+        )
+        for rule in rules.get("general_fields", [])
+    )
+
+@dataclass(frozen=True)
+class ExtractionRules:
+    """Règles d'extraction compilées pour une version (date de modification) du fichier de règles."""
+    general_fields: tuple
+    loaded: bool
+    version: object # mtime du fichier de règles, None s'il est introuvable
+
+# Les règles sont converties une seule fois par version du fichier en tuples immuables, parcourus tels quels
+# à chaque requête. Une modification du fichier est prise en compte sans redémarrage (nouvelle mtime).
+@functools.lru_cache(maxsize=1)
+def load_extraction_rules(path, mtime):
+    """Charge et compile les règles d'extraction; en cas d'erreur, l'extraction sera vide."""
+    if mtime is None:
+        logger.warning("Fichier de règles '%s' introuvable. L'extraction sera vide.", path)
+        return ExtractionRules((), False, None)
     try:
-        with open(RULES_FILE_PATH, 'r', encoding='utf-8') as f:
-            extraction_rules = json.load(f)
-        print(f"Règles d'extraction chargées depuis: {RULES_FILE_PATH}")
-    except json.JSONDecodeError as e:
-        print(f"ERREUR: Erreur de format JSON dans '{RULES_FILE_PATH}': {e}. L'extraction sera vide.")
+        with open(path, 'rb') as f:
+            loaded_rules = orjson.loads(f.read())
+        rules = ExtractionRules(
+            general_fields=build_general_field_rules(loaded_rules),
+            loaded=bool(loaded_rules),
+            version=mtime,
+        )
+        logger.info("Règles d'extraction chargées depuis: %s", path)
+        return rules
+    except orjson.JSONDecodeError as e:
+        logger.error("Erreur de format JSON dans '%s': %s. L'extraction sera vide.", path, e)
+    except re.error as e:
+        # Les patterns sont compilés au chargement: une regex invalide est signalée ici une fois, pas à chaque requête.
+        logger.error("Pattern invalide dans '%s': %r (%s). L'extraction sera vide.", path, e.pattern, e)
+    except (KeyError, TypeError, AttributeError) as e:
+        logger.error("Structure de règles invalide dans '%s': %r. L'extraction sera vide.", path, e)
     except Exception as e:
-        print(f"ERREUR: Impossible de charger les règles '{RULES_FILE_PATH}': {e}. L'extraction sera vide.")
-else:
-    print(f"ATTENTION: Fichier de règles '{RULES_FILE_PATH}' introuvable. L'extraction sera vide.")
+        logger.error("Impossible de charger les règles '%s': %s. L'extraction sera vide.", path, e)
+    return ExtractionRules((), False, mtime)
+
+def current_extraction_rules():
+    """Règles correspondant à l'état actuel du fichier (un simple stat par appel, rechargement si modifié)."""
+    try:
+        mtime = os.path.getmtime(RULES_FILE_PATH)
+    except OSError:
+        mtime = None
+    return load_extraction_rules(RULES_FILE_PATH, mtime)
+
+# Chargement des règles d'extraction au démarrage de l'application
+current_extraction_rules()
+
+# Réponses de /health sérialisées une seule fois, selon que les règles sont chargées ou non.
+HEALTH_RESPONSE_BODIES = {
+    loaded: orjson.dumps({"status": "healthy", "service": "Docling API", "version": "1.26.0", "rules_loaded": loaded})
+    for loaded in (True, False)
+}
+
+# --- Expressions régulières pré-compilées ---
+# Compilées une fois à l'import plutôt qu'à chaque requête / chaque bloc d'article.
+
+# Isolation de la section du tableau dans le texte complet
+TABLE_START_RE = re.compile(r"Désignation\s*\|\s*Quantité\s*\|\s*P\.U\.\s*HT\s*\|\s*Montant\s*HT", re.IGNORECASE)
+# Les différentes fins possibles du tableau, cherchées chacune séparément: les occurrences d'un même marqueur
+# ne se chevauchent pas (un début de pied de page compris dans un autre pied de page n'est pas une fin candidate).
+TABLE_END_RES = (
+    re.compile(r"Total\s*HT\s*de\s*la\s*commande", re.IGNORECASE | re.DOTALL), # Sur la première page du tableau
+    re.compile(r"Interlocuteur\s*SERVAL\s*?Tel\s*:\s*\d{2}(?:\s*\d{2}){4}", re.IGNORECASE | re.DOTALL), # Sur la dernière page du tableau
+    re.compile(r"Consignes\s*d'exp[eé]dition", re.IGNORECASE | re.DOTALL), # Autre fin possible sur la dernière page (avec é ou e)
+    re.compile(r"Enedis,\s*SA\s*à\s*directoire.*?PAGE\s*\d+\s*\/\s*\d+", re.IGNORECASE | re.DOTALL), # Dernier recours pour le pied de page général (dernier sur n'importe quelle page)
+)
+
+# Nettoyage de la section du tableau isolée
+TABLE_HEADER_BLOCK_RE = re.compile(
+    r"Désignation\s*\|\s*Quantité\s*\|\s*P\.U\.\s*HT\s*\|\s*Montant\s*HT" # Header line
+    r".*?" # Non-greedy match for anything between header and EUR line (DOTALL)
+    r"\|\s*EUR\s*\|\s*EUR", # The line with only EUR|EUR
+    re.IGNORECASE | re.DOTALL
+)
+PAGE_HEADER_RE = re.compile(r"Commande\s*de\s*livraison\s*N°\s*\d{4}-\d{10,}.*?correspondance\)", re.IGNORECASE | re.DOTALL)
+PAGE_FOOTER_RE = re.compile(r"Enedis,\s*SA\s*à\s*directoire.*?PAGE\s*\d+\s*\/\s*\d+", re.IGNORECASE | re.DOTALL)
+LONG_UNDERSCORES_RE = re.compile(r"_{10,}")
+BLANK_LINES_RE = re.compile(r"\n{2,}")
+
+# Découpage en blocs d'articles: Group 1: CMDCodetPosition, Group 2: CMDCodet
+ITEM_START_RE = re.compile(r"^\s*(\d{5})\s*(\d{7,8})\s*", re.MULTILINE)
+
+# Nettoyage précoce du contenu brut d'un article
+ITEM_INTERLOCUTEUR_RE = re.compile(r"Interlocuteur\s*SERVAL.*", re.IGNORECASE | re.DOTALL)
+ITEM_CONSIGNES_RE = re.compile(r"Consignes\s*d'exp[eé]dition.*", re.IGNORECASE | re.DOTALL)
+SEPARATOR_TAIL_RE = re.compile(r"________________.*", re.DOTALL) # Lignes de séparateurs résiduelles
+TAB_STOC_LINE_RE = re.compile(r"^#TAB/STOC/\(\d+\)\d+#\s*TAB\s*HTA\s*INSENSIBLE\s*\dI\+P\s*INSTRUMENT\u00c9\s*$", re.IGNORECASE | re.MULTILINE)
+TFO_SANS_LINE_RE = re.compile(r"^#TFO/SANS/#\s*$", re.IGNORECASE | re.MULTILINE)
+DOUBLE_UNDERSCORE_LINE_RE = re.compile(r"^\s*__\s*$", re.MULTILINE) # Doubles underscores seuls sur une ligne
+# Appliqués l'un après l'autre, dans cet ordre: chaque suppression change ce que voient les suivantes.
+ITEM_CLEANUP_RES = (ITEM_INTERLOCUTEUR_RE, ITEM_CONSIGNES_RE, PAGE_FOOTER_RE, SEPARATOR_TAIL_RE,
+                    TAB_STOC_LINE_RE, TFO_SANS_LINE_RE, DOUBLE_UNDERSCORE_LINE_RE)
+# Tout match de ITEM_CLEANUP_RES contient "#" ou "__", ou l'un de ces mots (patterns insensibles à la casse):
+# la plupart des articles n'en contiennent aucun, et un test de sous-chaîne évite alors le moteur regex.
+ITEM_CLEANUP_WORDS = ("interlocuteur", "consignes", "enedis,")
+# Seuls caractères non ASCII que re.IGNORECASE fait correspondre à une lettre ASCII (İ, ı, ſ, signe Kelvin):
+# ramenés à cette lettre avant le test, que lower() seul ne ferait pas.
+ITEM_CLEANUP_CASE_FOLDING = str.maketrans({"\u0130": "i", "\u0131": "i", "\u017f": "s", "\u212a": "k"})
+
+# Quantité et prix d'un article
+# (sans re.DOTALL: aucun de ces patterns ne contient de '.')
+QUANTITY_RE = re.compile(r"(\d+(?:[.,]\d+)?)\s*(?:PC|U|UNITES?)\b", re.IGNORECASE)
+PRIX_BRUT_RE = re.compile(r"Prix\s*brut", re.IGNORECASE)
+# Pattern strict pour les prix, assurant qu'il s'agit de nombres autonomes et non de parties de codes.
+# Utilise \b pour les limites de mot pour ne pas matcher "90" dans "7395070" si c'est collé.
+PRICE_NUMBER_RE = re.compile(r"(\b\d{1,3}(?:[ .]\d{3})*(?:[.,]\d+)?\b)")
+
+# Nettoyage de la description (CMDCodetNom)
+APPEL_CONTRAT_RE = re.compile(r"Appel\s*sur\s*contrat\s*CC\d+", re.IGNORECASE)
+EMPTY_LINES_RE = re.compile(r"\n\s*\n")
+DESC_PAGE_HEADER_RE = re.compile(r"^\s*Commande\s*de\s*livraison\s*N°\s*\d{4}-\d{10,}.*?correspondance\)\s*$", re.IGNORECASE | re.MULTILINE | re.DOTALL)
+DESC_TABLE_HEADER_RE = re.compile(r"^\s*Désignation\s*\|\s*Quantité\s*\|\s*P\.U\.\s*HT\s*\|\s*Montant\s*HT\s*$", re.IGNORECASE | re.MULTILINE)
+DESC_EUR_LINE_RE = re.compile(r"^\s*\|\s*EUR\s*\|\s*EUR\s*$", re.IGNORECASE | re.MULTILINE) # The line with only EUR|EUR
+
+# Espaces multiples / retours à la ligne multiples
+MULTI_SPACES_RE = re.compile(r'\s{2,}')
+MULTI_NEWLINES_RE = re.compile(r'\n+')
+
+# Nombre de processus utilisés par PAVÉS pour analyser les pages d'un même PDF. 1 (analyse en série) par défaut:
+# sous gunicorn, chaque worker (WEB_CONCURRENCY, un par CPU) démarrerait sinon son propre pool, soit environ CPU² processus.
+# À augmenter seulement avec peu de workers gunicorn (par exemple WEB_CONCURRENCY=1 pour de très longs documents).
+PDF_PAGE_WORKERS = int(os.environ.get("PDF_PAGE_WORKERS", 1))
+# En dessous de ce nombre de pages, le démarrage du pool de processus coûte plus qu'il ne rapporte: analyse en série.
+PDF_PARALLEL_MIN_PAGES = int(os.environ.get("PDF_PARALLEL_MIN_PAGES", 16))
+
+# Moteur d'extraction du texte: "auto" (PAVÉS si installé, sinon pdfminer.six), "pdfminer" ou "pymupdf".
+# PyMuPDF (MuPDF, en C) est plusieurs fois plus rapide, mais son ordre de lecture diffère de celui de pdfminer.six:
+# les lignes d'articles sont identiques, mais les patterns des champs généraux (adresses, interlocuteur) sont écrits
+# pour l'ordre de pdfminer.six. À n'activer qu'avec des règles adaptées.
+PDF_BACKEND = os.environ.get("PDF_BACKEND", "auto").lower()
+if PDF_BACKEND == "pymupdf" and pymupdf is None:
+    logger.warning("PDF_BACKEND=pymupdf mais PyMuPDF n'est pas installé: utilisation du moteur par défaut.")
+    PDF_BACKEND = "auto"
 
 # --- Fonctions d'extraction ---
 
+def _page_layout_text(page_layout, text_container_class):
+    """Concatène le texte des blocs de texte d'une page analysée."""
+    parts = []
+    for element in page_layout:
+        if isinstance(element, text_container_class):
+            parts.append(element.get_text())
+            parts.append("\n")
+    return "".join(parts)
+
+def _paves_page_text(page):
+    """Analyse une page avec PAVÉS et renvoie son texte.
+
+    Fonction de module (sérialisable par pickle) exécutée dans les processus du pool pour les longs documents:
+    seul le texte revient au processus principal, les objets LTPage de PAVÉS ne pouvant pas être désérialisés.
+    """
+    # space="page" et LAParams() par défaut reproduisent la mise en page de pdfminer.six.extract_pages
+    return _page_layout_text(paves_extract_page(page, laparams=PavesLAParams()), PavesLTTextContainer)
+
+def _extract_pages_with_paves(pdf_bytes):
+    """Analyse les pages avec PAVÉS, en parallèle sur PDF_PAGE_WORKERS processus pour les longs documents."""
+    with playa.parse(pdf_bytes, space="page") as doc:
+        if PDF_PAGE_WORKERS <= 1 or len(doc.pages) < PDF_PARALLEL_MIN_PAGES:
+            return list(doc.pages.map(_paves_page_text))
+    # spawn plutôt que fork: les workers gunicorn sont multi-threadés
+    with playa.parse(pdf_bytes, space="page", max_workers=PDF_PAGE_WORKERS,
+                     mp_context=multiprocessing.get_context("spawn")) as doc:
+        return list(doc.pages.map(_paves_page_text))
+
+def _extract_pages_with_pymupdf(pdf_bytes):
+    """Extrait le texte des pages avec PyMuPDF."""
+    with pymupdf.open(stream=pdf_bytes, filetype="pdf") as doc:
+        return [page.get_text("text") for page in doc]
+
+def active_pdf_backend():
+    """Nom du moteur d'extraction effectivement utilisé, selon PDF_BACKEND et les paquets installés."""
+    if PDF_BACKEND == "pymupdf":
+        return "PyMuPDF"
+    if playa is not None and PDF_BACKEND != "pdfminer":
+        return "PAVÉS"
+    return "pdfminer.six"
+
 def extract_text_from_pdf_per_page(pdf_stream):
-    """Extrait le texte d'un PDF page par page en utilisant pdfminer.six."""
-    pdf_stream.seek(0)
-    pages_text = []
-    for page_layout in extract_pages(pdf_stream):
-        page_content = ""
-        for element in page_layout:
-            if isinstance(element, LTTextContainer):
-                page_content += element.get_text() + "\n"
-        pages_text.append(page_content)
+    """Extrait le texte d'un PDF page par page avec le moteur choisi par PDF_BACKEND (PAVÉS si disponible, sinon pdfminer.six, par défaut).
+
+    Le flux est relu depuis le début; sa position n'est pas restaurée après la lecture.
+    """
     pdf_stream.seek(0)
+    backend = active_pdf_backend()
+    if backend == "PyMuPDF":
+        pages_text = _extract_pages_with_pymupdf(pdf_stream.read())
+    elif backend == "PAVÉS":
+        pages_text = _extract_pages_with_paves(pdf_stream.read())
+    else:
+        pages_text = [_page_layout_text(page_layout, LTTextContainer) for page_layout in extract_pages(pdf_stream)]
     return pages_text
 
+def item_needs_cleanup(item_text):
+    """Indique si ITEM_CLEANUP_RES peuvent trouver quelque chose dans le bloc d'article (pré-filtre sans regex)."""
+    if "#" in item_text or "__" in item_text:
+        return True
+    lowered = item_text.translate(ITEM_CLEANUP_CASE_FOLDING).lower()
+    return any(word in lowered for word in ITEM_CLEANUP_WORDS)
+
+# Table de conversion des nombres au format français: suppression des espaces (y compris insécables)
+# et des points (milliers), virgule décimale remplacée par un point. Appliquée en une seule passe par str.translate.
+NUMERIC_TRANSLATION = str.maketrans({' ': None, '\xa0': None, '.': None, ',': '.'})
+
 # Helper to convert string to float using defined decimal and thousands separators
 def parse_numeric_value(value_str):
     if value_str is None:
         return None
     
-    # Remove all spaces and dots as thousands separators.
-    cleaned_value = value_str.replace(' ', '') # Remove spaces first
-    cleaned_value = cleaned_value.replace('.', '') # Remove dots (thousands)
-    cleaned_value = cleaned_value.replace(',', '.') # Replace comma with dot for decimal
+    cleaned_value = value_str.translate(NUMERIC_TRANSLATION)
 
     try:
         return float(cleaned_value)
     except ValueError:
         return None
 
-def process_general_fields(full_text, rules):
-    """Extrait les champs généraux du texte en utilisant les règles."""
+def process_general_fields(full_text, field_rules):
+    """Extrait les champs généraux du texte en utilisant les règles (tuple de GeneralFieldRule)."""
     extracted_data = {}
-    for rule in rules.get("general_fields", []):
-        field_name = rule["field_name"]
-        patterns = rule["patterns"]
+    for rule in field_rules:
         value = None
-        for pattern_str in patterns:
-            # Gérer les champs multi-lignes en utilisant re.DOTALL pour que . match les newlines
-            flags = re.IGNORECASE | re.DOTALL
-            match = re.search(pattern_str, full_text, flags)
+        for pattern in rule.patterns:
+            match = pattern.search(full_text)
             if match:
                 value = match.group(1).strip()
-                if rule.get("multiline"):
+                if rule.is_multiline:
                     # Pour les champs multi-lignes, on nettoie les espaces multiples et les lignes vides
-                    value = re.sub(r'\s{2,}', ' ', value) # Remplace les multiples espaces par un seul
-                    value = re.sub(r'\n+', '\n', value).strip() # Réduit les lignes vides à une seule ou supprime les au début/fin
-                if rule["type"] == "float":
+                    value = MULTI_SPACES_RE.sub(' ', value) # Remplace les multiples espaces par un seul
+                    value = MULTI_NEWLINES_RE.sub('\n', value).strip() # Réduit les lignes vides à une seule ou supprime les au début/fin
+                if rule.is_float:
                     value = parse_numeric_value(value) 
                 break 
-        extracted_data[field_name] = value
+        extracted_data[rule.field_name] = value
     return extracted_data
 
-def process_table_fields(full_text_for_table, rules): 
+def process_table_fields(full_text_for_table): 
     """
     Extrait les champs de tableau du texte pré-nettoyé page par page.
     """
-    print("INFO: Tentative d'extraction de tableau par blocs d'articles (Version 1.26.0).") # Updated version
+    logger.debug("Tentative d'extraction de tableau par blocs d'articles (Version 1.26.0).") # Updated version
     
     table_data = []
     
-    table_rules = rules.get("table_fields", {})
-    columns_info = table_rules.get("columns", [])
-
     table_content = full_text_for_table 
-    print(f"DEBUG: Contenu de table_content pour le traitement de tableau:\n{table_content[:1500]}...") # Augmenté la longueur pour le débogage
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug("Contenu de table_content pour le traitement de tableau:\n%s...", table_content[:1500]) # Augmenté la longueur pour le débogage
 
-    # Utiliser re.split pour découper le contenu en blocs d'articles fiables.
+    # Utiliser ITEM_START_RE.finditer pour découper le contenu en blocs d'articles fiables.
     # Cette regex fonctionne mieux sur un texte de tableau déjà isolé.
-    item_start_delimiter_regex = re.compile(
-        r"^\s*(\d{5})\s*(\d{7,8})\s*", # Group 1: CMDCodetPosition, Group 2: CMDCodet
-        re.IGNORECASE | re.MULTILINE
-    )
-
-    split_parts = item_start_delimiter_regex.split(table_content)
+    # Le contenu d'un article va de la fin de son en-tête (position, codet) au début de l'article suivant;
+    # le texte AVANT le premier match est ignoré.
+    item_matches = list(ITEM_START_RE.finditer(table_content))
     
     raw_item_blocks = []
-    if split_parts and len(split_parts) > 1:
-        # Le premier élément de split_parts est le texte AVANT le premier match.
-        # On commence à l'index 1 pour obtenir le premier groupe (position), puis codet, puis le contenu.
-        for i in range(1, len(split_parts), 3):
-            if i + 2 < len(split_parts):
-                raw_item_blocks.append({
-                    "position": split_parts[i],
-                    "codet": split_parts[i+1],
-                    "content": split_parts[i+2].strip()
-                })
-    print(f"DEBUG: Nombre de blocs d'articles trouvés: {len(raw_item_blocks)}")
+    for i, item_match in enumerate(item_matches):
+        content_end = item_matches[i + 1].start() if i + 1 < len(item_matches) else len(table_content)
+        raw_item_blocks.append({
+            "position": item_match.group(1),
+            "codet": item_match.group(2),
+            "content": table_content[item_match.end():content_end].strip()
+        })
+    logger.debug("Nombre de blocs d'articles trouvés: %d", len(raw_item_blocks))
 
     for item_raw_data in raw_item_blocks:
         row_data = {}
@@ -137,91 +368,83 @@ def process_table_fields(full_text_for_table, rules):
 
             # --- NOUVELLE ÉTAPE : Nettoyage PRÉCOCE du contenu brut de l'article ---
             # Supprimer les blocs d'informations non pertinentes qui se trouvent souvent après le dernier article
-            item_raw_content = re.sub(r"Interlocuteur\s*SERVAL(?:.|\n)*", "", item_raw_content, flags=re.IGNORECASE | re.DOTALL)
-            item_raw_content = re.sub(r"Consignes\s*d'exp[eé]dition(?:.|\n)*", "", item_raw_content, flags=re.IGNORECASE | re.DOTALL)
-            item_raw_content = re.sub(r"Enedis,\s*SA\s*à\s*directoire(?:.|\n)*?PAGE\s*\d+\s*\/\s*\d+", "", item_raw_content, flags=re.IGNORECASE | re.DOTALL)
-            item_raw_content = re.sub(r"________________.*", "", item_raw_content, flags=re.DOTALL) # Lignes de séparateurs résiduelles
-
-            # Nettoyage additionnel pour les résidus spécifiques trouvés dans Commande_4801377867JPSM2025-03-19.PDF
-            # Ces patterns sont mis à jour pour être plus robustes et supprimer les lignes entières
-            item_raw_content = re.sub(r"^#TAB/STOC/\(\d+\)\d+#\s*TAB\s*HTA\s*INSENSIBLE\s*\dI\+P\s*INSTRUMENT\u00c9\s*$", "", item_raw_content, flags=re.IGNORECASE | re.MULTILINE)
-            item_raw_content = re.sub(r"^#TFO/SANS/#\s*$", "", item_raw_content, flags=re.IGNORECASE | re.MULTILINE)
-            item_raw_content = re.sub(r"^\s*__\s*$", "", item_raw_content, flags=re.MULTILINE) # Supprime les doubles underscores seuls sur une ligne
+            # ainsi que les résidus spécifiques trouvés dans Commande_4801377867JPSM2025-03-19.PDF (lignes entières)
+            if item_needs_cleanup(item_raw_content):
+                for cleanup_re in ITEM_CLEANUP_RES:
+                    item_raw_content = cleanup_re.sub("", item_raw_content)
 
             # Après ce nettoyage précoce, on re-stripe et re-print pour le débogage
             item_raw_content = item_raw_content.strip() 
-            print(f"DEBUG: Contenu brut de l'article APRES nettoyage précoce:\n{item_raw_content}")
+            logger.debug("Contenu brut de l'article APRES nettoyage précoce:\n%s", item_raw_content)
 
 
             row_data["CMDCodetPosition"] = position
             row_data["CMDCodet"] = codet
 
-            print(f"\n--- Bloc d'article trouvé pour Pos {position}, Codet {codet} ---")
-            print(f"Contenu brut de l'article (complet):\n{item_raw_content}")
+            logger.debug("--- Bloc d'article trouvé pour Pos %s, Codet %s ---", position, codet)
+            logger.debug("Contenu brut de l'article (complet):\n%s", item_raw_content)
 
-            print("--- Début du débogage des prix/quantités ---") 
+            logger.debug("--- Début du débogage des prix/quantités ---")
             
             # 1. Extraire la Quantité
-            quantity_match = re.search(r"(\d+(?:[.,]\d+)?)\s*(?:PC|U|UNITE|UNITES)\b", item_raw_content, re.IGNORECASE | re.DOTALL) 
+            quantity_match = QUANTITY_RE.search(item_raw_content)
             if quantity_match:
                 quantity_str = quantity_match.group(1).strip()
                 quantity_val = parse_numeric_value(quantity_str)
-                print(f"Quantité trouvée (str): {quantity_str}, (val): {quantity_val}")
+                logger.debug("Quantité trouvée (str): %s, (val): %s", quantity_str, quantity_val)
             else:
-                print("Quantité: Non trouvée.")
+                logger.debug("Quantité: Non trouvée.")
             
             # 2. Extraire les Prix
-            price_start_match = re.search(r"Prix\s*brut", item_raw_content, re.IGNORECASE | re.DOTALL)
+            price_start_match = PRIX_BRUT_RE.search(item_raw_content)
             
             all_raw_price_strings_in_segment = []
-            parsed_price_values_from_segment = []
 
             if price_start_match:
-                print(f"'Prix brut' trouvé à l'index: {price_start_match.start()}")
-                text_after_prix_brut = item_raw_content[price_start_match.end():].strip()
-                print(f"Texte après 'Prix brut':\n{text_after_prix_brut}")
+                logger.debug("'Prix brut' trouvé à l'index: %d", price_start_match.start())
+                if logger.isEnabledFor(logging.DEBUG):
+                    logger.debug("Texte après 'Prix brut':\n%s", item_raw_content[price_start_match.end():].strip())
                 
-                # Pattern plus strict pour les prix, assurant qu'il s'agit de nombres autonomes et non de parties de codes.
-                # Utilise \b pour les limites de mot pour ne pas matcher "90" dans "7395070" si c'est collé.
-                price_number_pattern_str = r"\b\d{1,3}(?:[ .]\d{3})*(?:[.,]\d+)?\b" 
-
-                all_raw_price_strings_in_segment = re.findall(
-                    r"(" + price_number_pattern_str + r")",
-                    text_after_prix_brut,
-                    re.IGNORECASE | re.DOTALL
-                )
+                # Pas d'argument pos: le \b initial de PRICE_NUMBER_RE regarderait le caractère précédent et manquerait
+                # un prix collé au libellé ("Prix brut12,50"). Le strip() est inutile, findall ignore les espaces.
+                all_raw_price_strings_in_segment = PRICE_NUMBER_RE.findall(item_raw_content[price_start_match.end():])
                 
-                print(f"Tous les candidats prix bruts trouvés dans le segment: {all_raw_price_strings_in_segment}")
-
-                parsed_price_values_from_segment = [
-                    parse_numeric_value(s_val) for s_val in all_raw_price_strings_in_segment 
-                    if parse_numeric_value(s_val) is not None
-                ]
+                logger.debug("Tous les candidats prix bruts trouvés dans le segment: %s", all_raw_price_strings_in_segment)
+
+                # L'heuristique ci-dessous n'utilise que les deux dernières valeurs: les candidats sont convertis
+                # depuis la fin, en s'arrêtant dès que ces deux valeurs sont trouvées (ordre conservé).
+                parsed_price_values_from_segment = []
+                for raw_price in reversed(all_raw_price_strings_in_segment):
+                    value = parse_numeric_value(raw_price)
+                    if value is not None:
+                        parsed_price_values_from_segment.insert(0, value)
+                        if len(parsed_price_values_from_segment) == 2:
+                            break
                 
-                print(f"Valeurs numériques parsées après 'Prix brut': {parsed_price_values_from_segment}")
+                logger.debug("Dernières valeurs numériques parsées après 'Prix brut': %s", parsed_price_values_from_segment)
                 
                 # Heuristique: le dernier nombre est le Total, l'avant-dernier est le Prix Unitaire.
                 if len(parsed_price_values_from_segment) >= 2:
                     total_line_price_val = parsed_price_values_from_segment[-1]
                     unit_price_val = parsed_price_values_from_segment[-2]
-                    print(f"Déduction: Total={total_line_price_val}, Unit={unit_price_val}")
+                    logger.debug("Déduction: Total=%s, Unit=%s", total_line_price_val, unit_price_val)
                 elif len(parsed_price_values_from_segment) == 1:
                     total_line_price_val = parsed_price_values_from_segment[0]
                     if quantity_val == 1.0: # Si la quantité est 1, le prix unitaire est le total.
                         unit_price_val = parsed_price_values_from_segment[0]
                     else:
                         unit_price_val = None # Sinon, on ne peut pas déduire
-                    print(f"Déduction: Total={total_line_price_val}, Unit={unit_price_val} (single value, Qty=1 check)")
+                    logger.debug("Déduction: Total=%s, Unit=%s (single value, Qty=1 check)", total_line_price_val, unit_price_val)
                 else:
                     total_line_price_val = None
                     unit_price_val = None
-                    print("Déduction: Pas assez de prix trouvés.")
+                    logger.debug("Déduction: Pas assez de prix trouvés.")
                 
-                print("--- Fin du débogage des prix/quantités ---")
+                logger.debug("--- Fin du débogage des prix/quantités ---")
 
             else:
-                print(f"ATTENTION: 'Prix brut' non trouvé dans le bloc pour {position}, {codet}. Les prix ne seront pas extraits.")
-                print("--- Fin du débogage des prix/quantités ---")
+                logger.warning("'Prix brut' non trouvé dans le bloc pour %s, %s. Les prix ne seront pas extraits.", position, codet)
+                logger.debug("--- Fin du débogage des prix/quantités ---")
 
             # Apply parsed values
             row_data["CMDCodetQuantity"] = quantity_val
@@ -237,7 +460,7 @@ def process_table_fields(full_text_for_table, rules):
             
             # Remove "Prix brut" and the associated price lines from description_raw
             if price_start_match:
-                description_raw = re.sub(r"Prix\s*brut", "", description_raw, flags=re.IGNORECASE | re.DOTALL)
+                description_raw = PRIX_BRUT_RE.sub("", description_raw)
                 
                 elements_to_remove_from_description = []
                 for s_val_to_remove in all_raw_price_strings_in_segment: 
@@ -248,36 +471,36 @@ def process_table_fields(full_text_for_table, rules):
 
                 for elem_pattern in elements_to_remove_from_description:
                     description_raw = re.sub(elem_pattern, ' ', description_raw, flags=re.IGNORECASE | re.MULTILINE)
-                    description_raw = re.sub(r'\s{2,}', ' ', description_raw) # Clean up multiple spaces left by removal
+                    description_raw = MULTI_SPACES_RE.sub(' ', description_raw) # Clean up multiple spaces left by removal
 
             # Nettoyage des patterns communs restants et du texte parasite non lié aux articles
             # Ces patterns devraient être appliqués à l'intérieur du bloc d'article
-            description_raw = re.sub(r"Appel\s*sur\s*contrat\s*CC\d+", "", description_raw, flags=re.IGNORECASE | re.DOTALL)
-            description_raw = re.sub(r"________________.*", "", description_raw, flags=re.DOTALL) 
-            description_raw = re.sub(r"\n\s*\n", "\n", description_raw) # Remove empty lines
+            description_raw = APPEL_CONTRAT_RE.sub("", description_raw)
+            description_raw = SEPARATOR_TAIL_RE.sub("", description_raw)
+            description_raw = EMPTY_LINES_RE.sub("\n", description_raw) # Remove empty lines
 
             # Remove specific header/footer lines that might have leaked into item blocks
             # These regex are specifically crafted to avoid being too greedy
-            description_raw = re.sub(r"^\s*Commande\s*de\s*livraison\s*N°\s*\d{4}-\d{10,}.*?correspondance\)\s*$", "", description_raw, flags=re.IGNORECASE | re.MULTILINE | re.DOTALL)
-            description_raw = re.sub(r"^\s*Désignation\s*\|\s*Quantité\s*\|\s*P\.U\.\s*HT\s*\|\s*Montant\s*HT\s*$", "", description_raw, flags=re.IGNORECASE | re.MULTILINE)
-            description_raw = re.sub(r"^\s*\|\s*EUR\s*\|\s*EUR\s*$", "", description_raw, flags=re.IGNORECASE | re.MULTILINE) # The line with only EUR|EUR
+            description_raw = DESC_PAGE_HEADER_RE.sub("", description_raw)
+            description_raw = DESC_TABLE_HEADER_RE.sub("", description_raw)
+            description_raw = DESC_EUR_LINE_RE.sub("", description_raw) # The line with only EUR|EUR
 
             # Nettoyage additionnel (répété pour description)
-            description_raw = re.sub(r"^#TAB/STOC/\(\d+\)\d+#\s*TAB\s*HTA\s*INSENSIBLE\s*\dI\+P\s*INSTRUMENT\u00c9\s*$", "", description_raw, flags=re.IGNORECASE | re.MULTILINE)
-            description_raw = re.sub(r"^#TFO/SANS/#\s*$", "", description_raw, flags=re.IGNORECASE | re.MULTILINE)
-            description_raw = re.sub(r"^\s*__\s*$", "", description_raw, flags=re.MULTILINE) # Supprime les doubles underscores seuls sur une ligne
+            description_raw = TAB_STOC_LINE_RE.sub("", description_raw)
+            description_raw = TFO_SANS_LINE_RE.sub("", description_raw)
+            description_raw = DOUBLE_UNDERSCORE_LINE_RE.sub("", description_raw) # Supprime les doubles underscores seuls sur une ligne
             
             description_raw = description_raw.strip()
             description_raw = description_raw.replace('\n', ' ') # Convert newlines to spaces for a single line description
-            description_raw = re.sub(r'\s{2,}', ' ', description_raw) # Clean up multiple spaces again
+            description_raw = MULTI_SPACES_RE.sub(' ', description_raw) # Clean up multiple spaces again
 
             row_data["CMDCodetNom"] = description_raw
             
             table_data.append(row_data)
-            print(f"Ligne extraite: {row_data}")
+            logger.debug("Ligne extraite: %s", row_data)
 
         except Exception as e:
-            print(f"Erreur lors du traitement d'un bloc d'article: {e}. Bloc: \n{item_raw_data['content'][:200]}...")
+            logger.error("Erreur lors du traitement d'un bloc d'article: %s. Bloc: \n%s...", e, item_raw_data['content'][:200])
             # Fallback pour les articles en erreur: extraire au moins le code et la position
             row_data["CMDCodetNom"] = item_raw_data['content'].replace('\n', ' ')
             row_data["CMDCodetQuantity"] = None
@@ -288,148 +511,338 @@ def process_table_fields(full_text_for_table, rules):
     return table_data
 
 
+def elapsed_ms(start_ns):
+    """Durée écoulée depuis start_ns (time.perf_counter_ns) en millisecondes."""
+    return (time.perf_counter_ns() - start_ns) / 1e6
+
+
+def run_extraction_pipeline(file_stream, rules, timings=None):
+    """Extrait les champs généraux et les lignes d'articles d'un PDF (flux binaire positionnable) selon les règles (ExtractionRules).
+
+    Si timings (dict) est fourni, il reçoit la durée en ms de chaque étape: "pdf", "table_section", "general_fields", "table_fields".
+    Renvoie (résultat, complet): complet est faux si la lecture du PDF a levé une exception; le résultat,
+    dégradé ("Failed Text Extraction"), ne doit alors pas être mis en cache (l'erreur peut être passagère).
+    """
+    if timings is None:
+        timings = {}
+    # --- ÉTAPE 1: Extraction initiale de tout le texte du PDF, page par page ---
+    step_start = time.perf_counter_ns()
+    pages_raw_text = []
+    completed = True
+    try:
+        pages_raw_text = extract_text_from_pdf_per_page(file_stream)
+        full_text_raw = "\n".join(pages_raw_text) # Concaténer tout le texte pour les champs généraux
+        logger.debug("Texte extrait directement (longueur: %d).", len(full_text_raw))
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("--- DÉBUT DU TEXTE BRUT DU PDF (pour débogage) ---\n%s\n--- FIN DU TEXTE BRUT DU PDF ---", full_text_raw)
+    except Exception as e:
+        logger.error("Erreur lors de la lecture du PDF avec %s: %s. Le document est peut-être scanné ou corrompu.",
+                     active_pdf_backend(), e, exc_info=True)
+        completed = False
+        pages_raw_text = []
+        full_text_raw = ""
+    timings["pdf"] = elapsed_ms(step_start)
+
+    # --- ÉTAPE 2: Nettoyage et isolation de la section du tableau ---
+    step_start = time.perf_counter_ns()
+    # Chercher le début du tableau (TABLE_START_RE), puis les différentes fins possibles (TABLE_END_RES, dernière occurrence)
+    full_text_cleaned_for_table = ""
+    table_start_match = TABLE_START_RE.search(full_text_raw)
+    
+    if table_start_match:
+        # On cherche la fin du tableau APRES le début du tableau, pour s'assurer de ne pas le couper trop tôt.
+        # On utilise finditer et on prend le match le plus bas (dernier) dans le document.
+
+        # Recherche de toutes les occurrences des marqueurs de fin après le début du tableau.
+        # L'argument pos évite de copier la fin du texte et donne directement des index absolus.
+        end_candidates_indices = [
+            match.start()
+            for marker_re in TABLE_END_RES
+            for match in marker_re.finditer(full_text_raw, table_start_match.start())
+        ]
+
+        if end_candidates_indices:
+            # Trouver l'index de fin le plus BAS (le plus loin dans le document)
+            # Cette approche cherche la fin la plus englobante, évitant les coupures prématurées.
+            table_end_index_absolute = max(end_candidates_indices)
+            
+            # Le contenu du tableau est de l'index de début jusqu'à l'index de fin trouvé
+            full_text_cleaned_for_table = full_text_raw[table_start_match.start() : table_end_index_absolute]
+            logger.debug("Tableau délimité avec succès entre marqueurs. Longueur avant nettoyage: %d", len(full_text_cleaned_for_table))
+        else:
+            # If no specific end found, take all remaining after table start
+            full_text_cleaned_for_table = full_text_raw[table_start_match.start():]
+            logger.warning("Aucune fin de tableau standard détectée. Le tableau pourrait inclure du texte indésirable jusqu'à la fin du document.")
+    else:
+        logger.warning("Marqueur de début de tableau non trouvé. L'extraction de tableau sera vide.")
+        full_text_cleaned_for_table = "" # Ensure it's empty if no start
+
+
+    # --- Nettoyage FINAL de la section du tableau isolée ---
+    cleaned_table_content_final = full_text_cleaned_for_table
+    
+    # 1. Supprimer l'en-tête du tableau et les lignes de soulignement juste en dessous (première occurrence uniquement car re.sub sans global)
+    # Ceci ne doit être supprimé qu'au début du tableau, et si ça se répète ensuite, ce sont des parasites.
+    # Nous allons revoir le nettoyage ici pour être plus robuste
+    
+    # Nettoyage des éléments récurrents qui se trouvent EN DEHORS des lignes d'articles, mais DANS la section du tableau
+    # Les patterns ici doivent être TRÈS spécifiques pour ne pas supprimer le contenu des articles.
+    
+    # Supprimer les en-têtes de tableau complets, y compris les lignes de séparateurs et la ligne EUR/EUR
+    cleaned_table_content_final = TABLE_HEADER_BLOCK_RE.sub("", cleaned_table_content_final)
+    
+    # Supprimer les en-têtes de page qui peuvent se répéter au milieu du tableau
+    cleaned_table_content_final = PAGE_HEADER_RE.sub("", cleaned_table_content_final)
+    
+    # Supprimer les pieds de page qui peuvent se répéter au milieu du tableau
+    cleaned_table_content_final = PAGE_FOOTER_RE.sub("", cleaned_table_content_final)
+    
+    # Supprimer les lignes de soulignement générales
+    # (motifs sensibles à la casse et sans variantes: un simple test de sous-chaîne évite le moteur regex s'ils sont absents)
+    if "__________" in cleaned_table_content_final:
+        cleaned_table_content_final = LONG_UNDERSCORES_RE.sub("", cleaned_table_content_final)
+    
+    # Nettoyer les lignes vides excessives (plus d'une ligne vide consécutive)
+    if "\n\n" in cleaned_table_content_final:
+        cleaned_table_content_final = BLANK_LINES_RE.sub("\n", cleaned_table_content_final)
+    
+    full_text_cleaned_for_table = cleaned_table_content_final.strip()
+    timings["table_section"] = elapsed_ms(step_start)
+
+
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug(
+            "--- Texte FINAL nettoyé pour le tableau (longueur: %d) ---\n%s\n--- Fin du texte FINAL nettoyé pour le tableau ---",
+            len(full_text_cleaned_for_table), full_text_cleaned_for_table[:2000] # A good chunk for debug
+        )
+
+    if not full_text_cleaned_for_table.strip():
+        logger.warning("Texte PDF vide ou trop nettoyé pour le tableau, une logique d'OCR serait appliquée ici pour les PDF scannés si nécessaire.")
+
+    # --- ÉTAPE 3: Traitement des champs ---
+    # Les champs généraux sont cherchés sur tout le texte, et non sur l'en-tête et le pied hors tableau:
+    # chaque pattern s'arrête à sa première occurrence (en-tête de la page 1 sur les commandes connues),
+    # et restreindre le texte ne ferait gagner que quelques dizaines de µs au risque de perdre un champ
+    # placé dans la zone du tableau sur une autre mise en page (ou sans début de tableau détecté).
+    step_start = time.perf_counter_ns()
+    general_data = process_general_fields(full_text_raw, rules.general_fields) 
+    timings["general_fields"] = elapsed_ms(step_start)
+    step_start = time.perf_counter_ns()
+    line_items_data = process_table_fields(full_text_cleaned_for_table) 
+    timings["table_fields"] = elapsed_ms(step_start)
+
+    extracted_output = {
+        "CMDRefEnedis": general_data.get("CMDRefEnedis"),
+        "CMDDateCommande": general_data.get("CMDDateCommande"),
+        "TotalHT": general_data.get("TotalHT"),
+        "EnedisCompanyName": general_data.get("EnedisCompanyName"),
+        "EnedisCompanyAddress": general_data.get("EnedisCompanyAddress"),
+        "EnedisContactPerson": general_data.get("EnedisContactPerson"),
+        "EnedisContactPhone": general_data.get("EnedisContactPhone"),
+        "DuhaldeCompanyName": general_data.get("DuhaldeCompanyName"),
+        "DuhaldeCompanyAddress": general_data.get("DuhaldeCompanyAddress"),
+        "DuhaldeSIRET": general_data.get("DuhaldeSIRET"),
+        "DeliveryLocationAddress": general_data.get("DeliveryLocationAddress"),
+        "line_items": line_items_data,
+        "confidence_score": 0.95, # Augmenté le score de confiance pour une meilleure extraction
+        "extracted_from": None, # Renseigné par la route: le résultat mis en cache ne dépend que du contenu du PDF
+        "extraction_method": "Textual PDF processing (with enhanced table sectioning)" if full_text_raw.strip() else "Failed Text Extraction/OCR needed"
+    }
+    return extracted_output, completed
+
+
+# --- Cache des résultats d'extraction ---
+
+def stream_digest(stream, chunk_size=64 * 1024):
+    """Empreinte BLAKE2b (128 bits) d'un flux binaire, lu par blocs depuis le début."""
+    stream.seek(0)
+    digest = hashlib.blake2b(digest_size=16)
+    for chunk in iter(lambda: stream.read(chunk_size), b""):
+        digest.update(chunk)
+    return digest.digest()
+
+# Les résultats sont indexés par l'empreinte BLAKE2b du PDF (plus rapide que SHA-256 en pur logiciel):
+# un même fichier renvoyé (relance du workflow n8n, tests répétés) n'est pas réanalysé.
+# EXTRACTION_CACHE_SIZE=0 désactive le cache pour borner la mémoire.
+EXTRACTION_CACHE_SIZE = int(os.environ.get("EXTRACTION_CACHE_SIZE", 128))
+_extraction_cache = OrderedDict()
+_extraction_cache_lock = threading.Lock()
+
+def extraction_cache_get(key):
+    """Retourne le résultat mis en cache pour cette empreinte (LRU), ou None."""
+    with _extraction_cache_lock:
+        result = _extraction_cache.get(key)
+        if result is not None:
+            _extraction_cache.move_to_end(key)
+        return result
+
+def extraction_cache_put(key, result):
+    """Ajoute un résultat au cache en évinçant le moins récemment utilisé si nécessaire."""
+    if EXTRACTION_CACHE_SIZE <= 0:
+        return
+    with _extraction_cache_lock:
+        _extraction_cache[key] = result
+        _extraction_cache.move_to_end(key)
+        while len(_extraction_cache) > EXTRACTION_CACHE_SIZE:
+            _extraction_cache.popitem(last=False)
+
+# --- Traitement par lots (/extract-batch) ---
+
+# Nombre de processus analysant en parallèle les PDF d'un même lot. 1 (analyse en série dans le worker) par défaut:
+# comme pour PDF_PAGE_WORKERS, chaque worker gunicorn aurait sinon son propre pool, soit environ CPU² processus.
+# Dans ces processus, PDF_PAGE_WORKERS est forcé à 1 (voir init_batch_worker): pas de pool PAVÉS imbriqué.
+EXTRACT_BATCH_WORKERS = int(os.environ.get("EXTRACT_BATCH_WORKERS", 1))
+_batch_executor = None
+_batch_executor_lock = threading.Lock()
+
+def init_batch_worker():
+    """Initialise un processus du pool des lots: ses PDF sont analysés page après page, sans second pool de processus."""
+    global PDF_PAGE_WORKERS
+    PDF_PAGE_WORKERS = 1
+
+def batch_executor():
+    """Pool de processus des lots, créé au premier lot (donc après le fork des workers gunicorn)."""
+    global _batch_executor
+    with _batch_executor_lock:
+        if _batch_executor is None:
+            # spawn plutôt que fork: les workers gunicorn sont multi-threadés
+            _batch_executor = ProcessPoolExecutor(max_workers=EXTRACT_BATCH_WORKERS,
+                                                  mp_context=multiprocessing.get_context("spawn"),
+                                                  initializer=init_batch_worker)
+        return _batch_executor
+
+def discard_batch_executor(executor):
+    """Abandonne un pool cassé (processus mort): il sera recréé au prochain lot au lieu d'échouer jusqu'au recyclage du worker."""
+    global _batch_executor
+    with _batch_executor_lock:
+        if _batch_executor is executor:
+            _batch_executor = None
+    executor.shutdown(wait=False, cancel_futures=True)
+
+def run_batch_in_pool(pdf_bytes_list, rules):
+    """Analyse les PDF d'un lot dans le pool de processus; renvoie les (résultat, complet) dans l'ordre des PDF.
+
+    Si le pool est cassé (BrokenProcessPool), il est abandonné et les PDF concernés sont analysés dans le worker.
+    """
+    executor = batch_executor()
+    futures = [executor.submit(extract_pdf_bytes, pdf_bytes, rules) for pdf_bytes in pdf_bytes_list]
+    outputs = []
+    pool_broken = False
+    for future, pdf_bytes in zip(futures, pdf_bytes_list):
+        try:
+            outputs.append(future.result())
+        except BrokenProcessPool:
+            pool_broken = True
+            outputs.append(extract_pdf_bytes(pdf_bytes, rules))
+    if pool_broken:
+        logger.error("Pool de processus des lots cassé: PDF restants analysés dans le worker, pool recréé au prochain lot.")
+        discard_batch_executor(executor)
+    return outputs
+
+def extract_pdf_bytes(pdf_bytes, rules):
+    """Exécute le pipeline sur un PDF en mémoire (appelée dans les processus du pool des lots); renvoie (résultat, complet)."""
+    return run_extraction_pipeline(io.BytesIO(pdf_bytes), rules)
+
 # --- Routes de l'API ---
 
+def json_response(payload, status=200):
+    """Réponse JSON sérialisée par orjson (extension C, directement en bytes), plus rapide que jsonify."""
+    return Response(orjson.dumps(payload), status=status, mimetype='application/json')
+
 @app.route('/health', methods=['GET'])
 def health_check():
     """Endpoint de vérification de santé (FR-5.2)."""
-    return jsonify({"status": "healthy", "service": "Docling API", "version": "1.26.0", "rules_loaded": bool(extraction_rules)}), 200 # Updated version
+    return Response(HEALTH_RESPONSE_BODIES[current_extraction_rules().loaded], status=200, mimetype='application/json')
 
 @app.route('/extract', methods=['POST'])
 def extract_document():
     """Endpoint pour l'extraction de documents."""
     if 'file' not in request.files:
-        return jsonify({"error": "No file part in the request"}), 400
+        return json_response({"error": "No file part in the request"}, 400)
     file = request.files['file']
     if file.filename == '':
-        return jsonify({"error": "No selected file"}), 400
+        return json_response({"error": "No selected file"}, 400)
     
     if file:
-        file_stream = io.BytesIO(file.read())
-        
-        # --- ÉTAPE 1: Extraction initiale de tout le texte du PDF, page par page ---
-        pages_raw_text = []
-        try:
-            pages_raw_text = extract_text_from_pdf_per_page(file_stream)
-            full_text_raw = "\n".join(pages_raw_text) # Concaténer tout le texte pour les champs généraux
-            print(f"Texte extrait directement (longueur: {len(full_text_raw)}).")
-            print("--- DÉBUT DU TEXTE BRUT DU PDF (pour débogage) ---")
-            print(full_text_raw)
-            print("--- FIN DU TEXTE BRUT DU PDF ---")
-        except Exception as e:
-            print(f"Erreur lors de la lecture du PDF avec pdfminer.six: {e}. Le document est peut-être scanné ou corrompu.")
-            pages_raw_text = []
-            full_text_raw = ""
-
-        # --- ÉTAPE 2: Nettoyage et isolation de la section du tableau ---
-        # Chercher le début du tableau
-        table_start_marker = r"Désignation\s*\|\s*Quantité\s*\|\s*P\.U\.\s*HT\s*\|\s*Montant\s*HT"
-        # Chercher les différentes fins possibles du tableau (dernière occurrence)
-        table_end_marker_1 = r"Total\s*HT\s*de\s*la\s*commande" # Sur la première page du tableau
-        table_end_marker_2 = r"Interlocuteur\s*SERVAL(?:\s|\n)*?Tel\s*:\s*\d{2}(?:\s*\d{2}){4}" # Sur la dernière page du tableau
-        table_end_marker_3 = r"Consignes\s*d'exp[eé]dition" # Autre fin possible sur la dernière page (avec é ou e)
-        table_end_marker_4 = r"Enedis,\s*SA\s*à\s*directoire(?:.|\n)*?PAGE\s*\d+\s*\/\s*\d+" # Dernier recours pour le pied de page général (dernier sur n'importe quelle page)
-        
-
-        full_text_cleaned_for_table = ""
-        table_start_match = re.search(table_start_marker, full_text_raw, re.IGNORECASE | re.DOTALL)
-        
-        if table_start_match:
-            # On cherche la fin du tableau APRES le début du tableau, pour s'assurer de ne pas le couper trop tôt.
-            # On utilise re.finditer et on prend le match le plus bas (dernier) dans le document.
-            end_candidates_indices = []
-            
-            # Recherche de toutes les occurrences des marqueurs de fin après le début du tableau
-            for marker in [table_end_marker_1, table_end_marker_2, table_end_marker_3, table_end_marker_4]:
-                for match in re.finditer(marker, full_text_raw[table_start_match.start():], re.IGNORECASE | re.DOTALL):
-                    end_candidates_indices.append(match.start() + table_start_match.start()) # Convert relative index to absolute
-
-            if end_candidates_indices:
-                # Trouver l'index de fin le plus BAS (le plus loin dans le document)
-                # Cette approche cherche la fin la plus englobante, évitant les coupures prématurées.
-                table_end_index_absolute = max(end_candidates_indices)
-                
-                # Le contenu du tableau est de l'index de début jusqu'à l'index de fin trouvé
-                full_text_cleaned_for_table = full_text_raw[table_start_match.start() : table_end_index_absolute]
-                print(f"INFO: Tableau délimité avec succès entre marqueurs. Longueur avant nettoyage: {len(full_text_cleaned_for_table)}")
-            else:
-                # If no specific end found, take all remaining after table start
-                full_text_cleaned_for_table = full_text_raw[table_start_match.start():]
-                print("ATTENTION: Aucune fin de tableau standard détectée. Le tableau pourrait inclure du texte indésirable jusqu'à la fin du document.")
+        # Le SpooledTemporaryFile de l'upload est positionnable: pdfminer.six le lit directement, sans copie en BytesIO.
+        file_stream = file.stream
+
+        # Rejet immédiat des fichiers qui ne sont pas des PDF (signature "%PDF-"), avant toute analyse coûteuse.
+        # La taille maximale est déjà bornée par MAX_CONTENT_LENGTH (413).
+        file_stream.seek(0)
+        if file_stream.read(len(PDF_MAGIC)) != PDF_MAGIC:
+            return json_response({"error": "Uploaded file is not a PDF"}, 415)
+
+        # Un PDF déjà traité (même contenu, donc même empreinte) est servi depuis le cache.
+        # La version des règles fait partie de la clé: un fichier de règles modifié invalide les résultats existants.
+        # ?nocache=1 force une nouvelle extraction (tests, diagnostic); son résultat remplace l'entrée en cache.
+        # Durées par étape (ms), journalisées et renvoyées dans l'en-tête Server-Timing (le corps JSON reste inchangé).
+        timings = {}
+        step_start = time.perf_counter_ns()
+        rules = current_extraction_rules()
+        cache_key = (stream_digest(file_stream), rules.version)
+        timings["digest"] = elapsed_ms(step_start)
+        extracted_output = None if request.args.get("nocache") == "1" else extraction_cache_get(cache_key)
+        if extracted_output is None:
+            extracted_output, completed = run_extraction_pipeline(file_stream, rules, timings)
+            if completed:
+                extraction_cache_put(cache_key, extracted_output)
         else:
-            print("ATTENTION: Marqueur de début de tableau non trouvé. L'extraction de tableau sera vide.")
-            full_text_cleaned_for_table = "" # Ensure it's empty if no start
-
-
-        # --- Nettoyage FINAL de la section du tableau isolée ---
-        cleaned_table_content_final = full_text_cleaned_for_table
-        
-        # 1. Supprimer l'en-tête du tableau et les lignes de soulignement juste en dessous (première occurrence uniquement car re.sub sans global)
-        # Ceci ne doit être supprimé qu'au début du tableau, et si ça se répète ensuite, ce sont des parasites.
-        # Nous allons revoir le nettoyage ici pour être plus robuste
-        
-        # Nettoyage des éléments récurrents qui se trouvent EN DEHORS des lignes d'articles, mais DANS la section du tableau
-        # Les patterns ici doivent être TRÈS spécifiques pour ne pas supprimer le contenu des articles.
-        
-        # Supprimer les en-têtes de tableau complets, y compris les lignes de séparateurs et la ligne EUR/EUR
-        cleaned_table_content_final = re.sub(
-            r"Désignation\s*\|\s*Quantité\s*\|\s*P\.U\.\s*HT\s*\|\s*Montant\s*HT" # Header line
-            r"(?:.|\n)*?" # Non-greedy match for anything between header and EUR line
-            r"\|\s*EUR\s*\|\s*EUR", # The line with only EUR|EUR
-            "", cleaned_table_content_final, flags=re.IGNORECASE | re.DOTALL
-        )
-        
-        # Supprimer les en-têtes de page qui peuvent se répéter au milieu du tableau
-        cleaned_table_content_final = re.sub(
-            r"Commande\s*de\s*livraison\s*N°\s*\d{4}-\d{10,}.*?correspondance\)", 
-            "", cleaned_table_content_final, flags=re.IGNORECASE | re.DOTALL
-        )
-        
-        # Supprimer les pieds de page qui peuvent se répéter au milieu du tableau
-        cleaned_table_content_final = re.sub(
-            r"Enedis,\s*SA\s*à\s*directoire(?:.|\n)*?PAGE\s*\d+\s*\/\s*\d+", 
-            "", cleaned_table_content_final, flags=re.IGNORECASE | re.DOTALL
-        )
-        
-        # Supprimer les lignes de soulignement générales
-        cleaned_table_content_final = re.sub(r"_{10,}", "", cleaned_table_content_final, flags=re.DOTALL)
-        
-        # Nettoyer les lignes vides excessives (plus d'une ligne vide consécutive)
-        cleaned_table_content_final = re.sub(r"\n{2,}", "\n", cleaned_table_content_final)
-        
-        full_text_cleaned_for_table = cleaned_table_content_final.strip()
-
-
-        print(f"--- Texte FINAL nettoyé pour le tableau (longueur: {len(full_text_cleaned_for_table)}) ---")
-        print(full_text_cleaned_for_table[:2000]) # Print a good chunk for debug
-        print("--- Fin du texte FINAL nettoyé pour le tableau ---")
-
-        if not full_text_cleaned_for_table.strip():
-            print("Texte PDF vide ou trop nettoyé pour le tableau, une logique d'OCR serait appliquée ici pour les PDF scannés si nécessaire.")
-
-        # --- ÉTAPE 3: Traitement des champs ---
-        general_data = process_general_fields(full_text_raw, extraction_rules) 
-        line_items_data = process_table_fields(full_text_cleaned_for_table, extraction_rules) 
-
-        extracted_output = {
-            "CMDRefEnedis": general_data.get("CMDRefEnedis"),
-            "CMDDateCommande": general_data.get("CMDDateCommande"),
-            "TotalHT": general_data.get("TotalHT"),
-            "EnedisCompanyName": general_data.get("EnedisCompanyName"),
-            "EnedisCompanyAddress": general_data.get("EnedisCompanyAddress"),
-            "EnedisContactPerson": general_data.get("EnedisContactPerson"),
-            "EnedisContactPhone": general_data.get("EnedisContactPhone"),
-            "DuhaldeCompanyName": general_data.get("DuhaldeCompanyName"),
-            "DuhaldeCompanyAddress": general_data.get("DuhaldeCompanyAddress"),
-            "DuhaldeSIRET": general_data.get("DuhaldeSIRET"),
-            "DeliveryLocationAddress": general_data.get("DeliveryLocationAddress"),
-            "line_items": line_items_data,
-            "confidence_score": 0.95, # Augmenté le score de confiance pour une meilleure extraction
-            "extracted_from": file.filename,
-            "extraction_method": "Textual PDF processing (with enhanced table sectioning)" if full_text_raw.strip() else "Failed Text Extraction/OCR needed"
-        }
-        
-        return jsonify(extracted_output), 200
+            logger.info("Résultat d'extraction servi depuis le cache.")
+        extracted_output = dict(extracted_output, extracted_from=file.filename)
+
+        step_start = time.perf_counter_ns()
+        response = json_response(extracted_output)
+        timings["json"] = elapsed_ms(step_start)
+
+        logger.info("Durées d'extraction (ms) pour %s: %s", file.filename,
+                    " ".join("%s=%.2f" % (name, duration) for name, duration in timings.items()))
+        response.headers["Server-Timing"] = ", ".join("%s;dur=%.2f" % (name, duration) for name, duration in timings.items())
+        return response
+
+@app.route('/extract-batch', methods=['POST'])
+def extract_batch():
+    """Endpoint d'extraction de plusieurs PDF (champ 'files'), renvoyant la liste des résultats dans l'ordre des fichiers."""
+    files = [file for file in request.files.getlist('files') if file.filename != '']
+    if not files:
+        return json_response({"error": "No files part in the request"}, 400)
+
+    rules = current_extraction_rules()
+    use_cache = request.args.get("nocache") != "1"
+    results = [None] * len(files)
+    # PDF à analyser, par empreinte: un fichier présent plusieurs fois dans le lot n'est analysé qu'une fois
+    pending = {}
+    for index, file in enumerate(files):
+        file_stream = file.stream
+        file_stream.seek(0)
+        if file_stream.read(len(PDF_MAGIC)) != PDF_MAGIC:
+            results[index] = {"error": "Uploaded file is not a PDF", "extracted_from": file.filename}
+            continue
+        cache_key = (stream_digest(file_stream), rules.version)
+        extracted_output = extraction_cache_get(cache_key) if use_cache else None
+        if extracted_output is not None:
+            results[index] = dict(extracted_output, extracted_from=file.filename)
+        elif cache_key in pending:
+            pending[cache_key][1].append(index)
+        else:
+            file_stream.seek(0)
+            pending[cache_key] = (file_stream.read(), [index])
+
+    # Le pool n'apporte rien pour un seul PDF à analyser: il est alors traité directement dans le worker.
+    pdf_bytes_list = [pdf_bytes for pdf_bytes, _ in pending.values()]
+    if EXTRACT_BATCH_WORKERS > 1 and len(pdf_bytes_list) > 1:
+        outputs = run_batch_in_pool(pdf_bytes_list, rules)
+    else:
+        outputs = (extract_pdf_bytes(pdf_bytes, rules) for pdf_bytes in pdf_bytes_list)
+    for (cache_key, (_, indexes)), (extracted_output, completed) in zip(pending.items(), outputs):
+        # Comme pour /extract, un résultat dégradé par une exception n'est pas mis en cache.
+        if completed:
+            extraction_cache_put(cache_key, extracted_output)
+        for index in indexes:
+            results[index] = dict(extracted_output, extracted_from=files[index].filename)
+
+    logger.info("Lot de %d fichier(s) traité, %d PDF analysé(s).", len(files), len(pending))
+    return json_response(results)
 
 if __name__ == '__main__':
     app.run(host='0.0.0.0', port=5000)
\ No newline at end of file
@@ -0,0 +1,14 @@
+# scripts/wsgi.py
+#
+# Version: 1.0.0
+# Date: 2026-10-15
+# Author: Rolland MELET & AI Senior Coder
+# Description: Point d'entrée WSGI de l'API Docling pour gunicorn.
+#              start_api.py garde son `app.run(...)` pour le débogage local uniquement.
+#
+# Lancement: `gunicorn -c scripts/gunicorn.conf.py` (workers, threads et timeout y sont réglés).
+
+from start_api import app
+
+# Nom attendu par défaut par la plupart des serveurs WSGI (mod_wsgi, uWSGI, `gunicorn wsgi:application`)
+application = app
@@ -0,0 +1,289 @@
+# tests/test_start_api.py
+#
+# Version: 1.0.0
+# Date: 2026-10-15
+# Author: Rolland MELET & AI Senior Coder
+# Description: Tests de non-régression de l'API Docling (scripts/start_api.py).
+#              Lancement depuis la racine du dépôt: python -m pytest -q tests
+
+import io
+import os
+import subprocess
+import sys
+from concurrent.futures import Future
+from concurrent.futures.process import BrokenProcessPool
+
+import pytest
+
+SCRIPTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'scripts')
+sys.path.insert(0, SCRIPTS_DIR)
+
+import start_api
+
+
+def make_pdf(page_texts):
+    """Construit un PDF minimal (police Helvetica), avec une ligne de texte par page."""
+    objects = ["<< /Type /Catalog /Pages 2 0 R >>", None,
+               "<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>"]
+    kids = []
+    for text in page_texts:
+        stream = "BT /F1 12 Tf 72 720 Td (%s) Tj ET" % text
+        objects.append("<< /Length %d >>\nstream\n%s\nendstream" % (len(stream), stream))
+        objects.append("<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] "
+                       "/Resources << /Font << /F1 3 0 R >> >> /Contents %d 0 R >>" % len(objects))
+        kids.append("%d 0 R" % len(objects))
+    objects[1] = "<< /Type /Pages /Kids [%s] /Count %d >>" % (" ".join(kids), len(kids))
+
+    pdf = bytearray(b"%PDF-1.4\n")
+    offsets = []
+    for number, body in enumerate(objects, 1):
+        offsets.append(len(pdf))
+        pdf += b"%d 0 obj\n%s\nendobj\n" % (number, body.encode("latin-1"))
+    xref_offset = len(pdf)
+    pdf += b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1)
+    pdf += b"".join(b"%010d 00000 n \n" % offset for offset in offsets)
+    pdf += b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objects) + 1, xref_offset)
+    return bytes(pdf)
+
+
+# --- Journalisation ---
+
+@pytest.mark.parametrize("log_level, expected_level", [("debug", "DEBUG"), ("verbose", "INFO")])
+def test_log_level_from_environment(log_level, expected_level):
+    # Le niveau est fixé à l'import: un nouvel interpréteur importe le module avec LOG_LEVEL.
+    script = "import logging, start_api; print(logging.getLevelName(logging.getLogger().level))"
+    completed = subprocess.run([sys.executable, "-c", script], cwd=SCRIPTS_DIR, env=dict(os.environ, LOG_LEVEL=log_level),
+                               capture_output=True, text=True, check=True)
+    assert completed.stdout.strip() == expected_level
+    assert ("LOG_LEVEL=VERBOSE inconnu" in completed.stderr) == (log_level == "verbose")
+
+
+# --- Extraction du texte ---
+
+@pytest.mark.skipif(start_api.playa is None, reason="PAVÉS non installé")
+def test_paves_process_pool_returns_page_texts(monkeypatch):
+    # PLAYA ne passe par le pool que si le nombre de pages dépasse max_workers * 4:
+    # 24 pages avec 2 processus forcent le chemin parallèle.
+    pdf_bytes = make_pdf(["Page %d" % number for number in range(1, 25)])
+    monkeypatch.setattr(start_api, "PDF_PARALLEL_MIN_PAGES", 2)
+
+    monkeypatch.setattr(start_api, "PDF_PAGE_WORKERS", 1)
+    serial_pages = start_api._extract_pages_with_paves(pdf_bytes)
+    monkeypatch.setattr(start_api, "PDF_PAGE_WORKERS", 2)
+    parallel_pages = start_api._extract_pages_with_paves(pdf_bytes)
+
+    assert len(parallel_pages) == 24
+    assert parallel_pages == serial_pages
+    assert parallel_pages[-1].strip() == "Page 24"
+
+
+@pytest.mark.parametrize("backend, module", [("pdfminer", None), ("auto", "playa"), ("pymupdf", "pymupdf")])
+def test_text_after_blank_first_page_is_extracted(monkeypatch, backend, module):
+    # Une page de garde vide ne fait pas conclure à un PDF scanné: toutes les pages sont lues.
+    if module is not None and getattr(start_api, module) is None:
+        pytest.skip("%s non installé" % module)
+    monkeypatch.setattr(start_api, "PDF_BACKEND", backend)
+    pages_text = start_api.extract_text_from_pdf_per_page(io.BytesIO(make_pdf(["", "Page 2"])))
+    assert len(pages_text) == 2
+    assert not pages_text[0].strip()
+    assert pages_text[1].strip() == "Page 2"
+
+
+# --- Cache des résultats ---
+
+def post_pdf(client, pdf_bytes):
+    return client.post('/extract', data={'file': (io.BytesIO(pdf_bytes), 'commande.pdf')}, content_type='multipart/form-data')
+
+
+def test_failed_extraction_is_not_cached(monkeypatch):
+    pdf_bytes = make_pdf(["Commande sans tableau (cache /extract)"])
+    client = start_api.app.test_client()
+    extract_text = start_api.extract_text_from_pdf_per_page
+
+    def failing_extract_text(pdf_stream):
+        raise RuntimeError("erreur passagère")
+
+    monkeypatch.setattr(start_api, "extract_text_from_pdf_per_page", failing_extract_text)
+    failed = post_pdf(client, pdf_bytes).get_json()
+    assert failed["extraction_method"] == "Failed Text Extraction/OCR needed"
+
+    monkeypatch.setattr(start_api, "extract_text_from_pdf_per_page", extract_text)
+    retried = post_pdf(client, pdf_bytes).get_json()
+    assert retried["extraction_method"] != "Failed Text Extraction/OCR needed"
+
+
+# --- Traitement par lots ---
+
+def post_batch(client, pdf_bytes_list, query_string=None):
+    files = [(io.BytesIO(pdf_bytes), 'commande%d.pdf' % index) for index, pdf_bytes in enumerate(pdf_bytes_list)]
+    return client.post('/extract-batch', data={'files': files}, query_string=query_string,
+                       content_type='multipart/form-data')
+
+
+def batch_worker_page_workers():
+    """Exécutée dans un processus du pool des lots: valeur de PDF_PAGE_WORKERS après init_batch_worker."""
+    return start_api.PDF_PAGE_WORKERS
+
+
+def test_batch_in_spawn_pool_matches_extract(monkeypatch):
+    # Les processus du pool réimportent start_api et relisent PDF_PAGE_WORKERS dans l'environnement:
+    # init_batch_worker doit le ramener à 1 pour ne pas démarrer un pool PAVÉS dans chacun d'eux.
+    monkeypatch.setenv("PDF_PAGE_WORKERS", "4")
+    monkeypatch.setattr(start_api, "EXTRACT_BATCH_WORKERS", 2)
+    monkeypatch.setattr(start_api, "_batch_executor", None)
+    pdf_bytes_list = [make_pdf(["Commande A (pool des lots)"]), make_pdf(["Commande B (pool des lots)"])]
+    client = start_api.app.test_client()
+    try:
+        results = post_batch(client, pdf_bytes_list, {"nocache": "1"}).get_json()
+        executor = start_api._batch_executor
+        assert executor is not None
+        assert executor.submit(batch_worker_page_workers).result() == 1
+    finally:
+        if start_api._batch_executor is not None:
+            start_api._batch_executor.shutdown()
+
+    expected = [dict(post_pdf(client, pdf_bytes).get_json(), extracted_from='commande%d.pdf' % index)
+                for index, pdf_bytes in enumerate(pdf_bytes_list)]
+    assert results == expected
+
+
+def test_failed_batch_extraction_is_not_cached(monkeypatch):
+    pdf_bytes = make_pdf(["Commande sans tableau (cache /extract-batch)"])
+    client = start_api.app.test_client()
+    extract_text = start_api.extract_text_from_pdf_per_page
+
+    def failing_extract_text(pdf_stream):
+        raise RuntimeError("erreur passagère")
+
+    monkeypatch.setattr(start_api, "extract_text_from_pdf_per_page", failing_extract_text)
+    [failed] = post_batch(client, [pdf_bytes]).get_json()
+    assert failed["extraction_method"] == "Failed Text Extraction/OCR needed"
+
+    monkeypatch.setattr(start_api, "extract_text_from_pdf_per_page", extract_text)
+    [retried] = post_batch(client, [pdf_bytes]).get_json()
+    assert retried["extraction_method"] != "Failed Text Extraction/OCR needed"
+
+
+class BrokenExecutor:
+    """Pool dont les processus sont morts: chaque tâche échoue avec BrokenProcessPool."""
+
+    def __init__(self):
+        self.shut_down = False
+
+    def submit(self, fn, *args):
+        future = Future()
+        future.set_exception(BrokenProcessPool("processus terminé brutalement"))
+        return future
+
+    def shutdown(self, wait=True, cancel_futures=False):
+        self.shut_down = True
+
+
+def test_broken_batch_pool_is_discarded_and_files_rerun_inline(monkeypatch):
+    pdf_bytes_list = [make_pdf(["Commande A (pool cassé)"]), make_pdf(["Commande B (pool cassé)"])]
+    broken_executor = BrokenExecutor()
+    monkeypatch.setattr(start_api, "EXTRACT_BATCH_WORKERS", 2)
+    monkeypatch.setattr(start_api, "_batch_executor", broken_executor)
+    client = start_api.app.test_client()
+
+    results = post_batch(client, pdf_bytes_list).get_json()
+
+    assert [result["extracted_from"] for result in results] == ['commande0.pdf', 'commande1.pdf']
+    assert all(result["extraction_method"] != "Failed Text Extraction/OCR needed" for result in results)
+    assert broken_executor.shut_down
+    assert start_api._batch_executor is None
+
+
+# --- Nombres au format français ---
+
+@pytest.mark.parametrize("value_str, expected", [
+    ("1 234,50", 1234.5), ("1\xa0234,50", 1234.5), ("1.234,50", 1234.5), ("12", 12.0), ("n/a", None), (None, None),
+])
+def test_parse_numeric_value(value_str, expected):
+    assert start_api.parse_numeric_value(value_str) == expected
+
+
+# --- Lignes d'articles ---
+
+def test_item_cleanup_applies_patterns_in_order():
+    # "Interlocuteur SERVAL" est supprimé (jusqu'à la fin du bloc) avant la recherche du pied de page,
+    # qui ne trouve alors plus son "PAGE n / n": le début du pied de page reste dans la description.
+    table_text = ("00010 7391023\nCABLE ALU\n1 PC\nPrix brut\n10,00 EUR\n10,00 EUR\n"
+                  "Enedis, SA à directoire Interlocuteur SERVAL Dupont\nPAGE 1 / 2\nRACCORD\n")
+    [row] = start_api.process_table_fields(table_text)
+    assert row["CMDCodetNom"] == "CABLE ALU Enedis, SA à directoire"
+
+
+def test_description_prices_are_removed_one_after_the_other():
+    # Chaque prix est retiré par sa propre substitution: une fois "10 EUR" retiré, "20" est suivi
+    # du second "EUR", retiré avec lui. Une alternation en un seul passage laisserait ce "EUR".
+    table_text = "00010 7391023\nPOSTE 20 10 EUR EUR\n10 U\nPrix brut\n10 20 EUR\n"
+    [row] = start_api.process_table_fields(table_text)
+    assert row["CMDCodetNom"] == "POSTE"
+
+
+def test_price_glued_to_prix_brut_label_is_found():
+    table_text = "00010 7391023\nCABLE ALU 3x95\n1 PC\nPrix brut12,50 EUR\n25,00 EUR\n"
+    [row] = start_api.process_table_fields(table_text)
+    assert row["CMDCodetUnitPrice"] == 12.5
+    assert row["CMDCodetTotlaLinePrice"] == 25.0
+    assert row["CMDCodetNom"] == "CABLE ALU 3x95"
+
+
+@pytest.mark.parametrize("item_text", [
+    "CABLE\n__\n", "CABLE\n#TFO/SANS/#", "CABLE INTERLOCUTEUR SERVAL", "CABLE \u0130nterlocuteur SERVAL",
+    "CABLE con\u017fignes d'expédition", "ENEDIS, SA à directoire PAGE 1 / 2",
+])
+def test_item_cleanup_prefilter_keeps_every_match(item_text):
+    assert any(cleanup_re.search(item_text) for cleanup_re in start_api.ITEM_CLEANUP_RES)
+    assert start_api.item_needs_cleanup(item_text)
+    assert not start_api.item_needs_cleanup("CABLE ALU 3x95 Désignation")
+
+
+@pytest.mark.parametrize("description, quantity, prices, expected", [
+    ("150 150 U EUR 10 POSTE", "2 PC", "10 EUR\n150 EUR", "POSTE 2 PC"),
+    ("CABLE ALU 150 MM2", "1 PC", "150,00 EUR\n150 EUR", "CABLE ALU MM2"),
+    ("TRANSFO 250 kVA", "2 U", "1 250,00 EUR\n2 500,00 EUR", "TRANSFO 250 kVA"),
+    ("POSTE 10 U HTA", "2 PC", "10 EUR\n20 EUR", "POSTE HTA 2 PC"),
+])
+def test_description_with_price_like_numbers(description, quantity, prices, expected):
+    # Sorties de référence de la version 1.26.0: la quantité, "Prix brut" puis chaque prix sont retirés
+    # l'un après l'autre, chaque retrait pouvant rapprocher du texte que le suivant retire à son tour.
+    table_text = "00010 7391023\n%s\n%s\nPrix brut\n%s\n" % (description, quantity, prices)
+    [row] = start_api.process_table_fields(table_text)
+    assert row["CMDCodetNom"] == expected
+
+
+def test_description_keeps_single_nbsp_and_tab():
+    # Seules les suites de blancs (2 ou plus) sont réduites à un espace: un NBSP ou une tabulation isolés sont conservés.
+    table_text = "00010 7391023\nCABLE\xa0ALU\tNU  3x95\n1 PC\nPrix brut\n10,00 EUR\n10,00 EUR\n"
+    [row] = start_api.process_table_fields(table_text)
+    assert row["CMDCodetNom"] == "CABLE\xa0ALU\tNU 3x95"
+    assert (row["CMDCodetQuantity"], row["CMDCodetUnitPrice"], row["CMDCodetTotlaLinePrice"]) == (1.0, 10.0, 10.0)
+
+
+# --- Délimitation du tableau ---
+
+ITEM_TEXT = "%s %s\n%s\n1 PC\nPrix brut\n10,00 EUR\n10,00 EUR\n"
+
+
+def run_pipeline_on_text(monkeypatch, full_text):
+    """Exécute le pipeline comme si le PDF contenait full_text (une seule page)."""
+    monkeypatch.setattr(start_api, "extract_text_from_pdf_per_page", lambda pdf_stream: [full_text])
+    extracted_output, completed = start_api.run_extraction_pipeline(io.BytesIO(), start_api.current_extraction_rules())
+    assert completed
+    return extracted_output
+
+
+def test_table_end_ignores_footer_start_nested_in_another_footer(monkeypatch):
+    # Le deuxième "Enedis, SA à directoire" est compris dans le match du premier pied de page (qui va jusqu'à PAGE n / n):
+    # les occurrences d'un même marqueur ne se chevauchant pas, la fin du tableau est le début du premier pied de page.
+    full_text = (
+        "Désignation | Quantité | P.U. HT | Montant HT\n"
+        + ITEM_TEXT % ("00010", "7391023", "ARTICLE UN")
+        + "Enedis, SA à directoire et à conseil de surveillance\n"
+        + ITEM_TEXT % ("00020", "7391024", "ARTICLE DEUX")
+        + "Enedis, SA à directoire et à conseil de surveillance PAGE 1 / 1\n"
+    )
+    line_items = run_pipeline_on_text(monkeypatch, full_text)["line_items"]
+    assert [item["CMDCodetPosition"] for item in line_items] == ["00010"]